@@ -1,8 +1,298 @@
+import logging
 import time
-import math
-from collections import deque
 
-async def process_z_score_outliers(get_historical_data, generate_data_stream, window=45, threshold=2.25, timestamp_increment=86_400, stream_delay=1):
+import numba
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Rounding errors in the rolling mean and M2 leave a tiny (or even negative) variance
+# once the rolling window holds equal values. Rolling variances within this tolerance,
+# relative to the squared rolling mean (i.e. rolling standard deviations within 1e-10
+# of the rolling mean), are treated as 0.
+_VARIANCE_TOLERANCE = 1e-20
+
+@numba.njit(cache=True, fastmath=True)
+def _add_to_rolling_window(rolling_mean, rolling_m2, window_count, value):
+    """Adds a value to a rolling mean and M2, with Welford's online algorithm.
+
+    Parameters
+    ----------
+    rolling_mean : float
+        The mean of the rolling window.
+    rolling_m2 : float
+        The sum of squared differences from the mean of the rolling window.
+    window_count : int
+        The number of values in the rolling window, after adding the value.
+    value : float
+        The value to add.
+
+    Returns
+    -------
+    tuple
+        A tuple with two elements: the updated rolling mean, and the updated M2.
+    """
+    delta = value - rolling_mean
+    rolling_mean += delta / window_count
+    rolling_m2 += delta * (value - rolling_mean)
+    return rolling_mean, rolling_m2
+
+@numba.njit(cache=True, fastmath=True)
+def _remove_from_rolling_window(rolling_mean, rolling_m2, window_count, value):
+    """Removes a value from a rolling mean and M2, with Welford's online algorithm.
+
+    Parameters
+    ----------
+    rolling_mean : float
+        The mean of the rolling window.
+    rolling_m2 : float
+        The sum of squared differences from the mean of the rolling window.
+    window_count : int
+        The number of values in the rolling window, before removing the value.
+    value : float
+        The value to remove.
+
+    Returns
+    -------
+    tuple
+        A tuple with two elements: the updated rolling mean, and the updated M2.
+    """
+    delta = value - rolling_mean
+    rolling_mean -= delta / (window_count - 1)
+    rolling_m2 -= delta * (value - rolling_mean)
+
+    # Rounding errors may leave M2 slightly negative once the remaining values are
+    # (nearly) all equal, while a sum of squares can't be, so floor it at 0.
+    rolling_m2 = max(rolling_m2, 0.0)
+    return rolling_mean, rolling_m2
+
+@numba.njit(cache=True, fastmath=True)
+def _is_outlier(value, rolling_mean, rolling_variance, squared_threshold):
+    """Determines whether a value is an outlier of the rolling window.
+
+    Comparing the squared distance from the rolling mean against the squared threshold
+    times the rolling variance is equivalent to comparing the z-score against the
+    threshold, without needing a square root or a division.
+
+    Parameters
+    ----------
+    value : float
+        The value in the rolling window.
+    rolling_mean : float
+        The mean of the rolling window.
+    rolling_variance : float
+        The sample variance of the rolling window.
+    squared_threshold : float
+        The square of the threshold, in standard deviations away from the rolling mean,
+        outside of which the value is an outlier.
+
+    Returns
+    -------
+    bool
+        Whether or not the value is an outlier.
+    """
+    # A rolling window of equal values has no outliers, however its variance was rounded.
+    if rolling_variance <= _VARIANCE_TOLERANCE * rolling_mean * rolling_mean:
+        return False
+
+    difference = value - rolling_mean
+    return difference * difference > squared_threshold * rolling_variance
+
+@numba.njit(cache=True, fastmath=True)
+def _rolling_z_score_step(window_values, window_index, window_count, rolling_mean, rolling_m2, value, squared_threshold):
+    """Adds a value to the rolling window, and determines whether it is an outlier.
+
+    This function is compiled to native code with Numba, so that the rolling window
+    calculations at each data point don't go through the Python interpreter. The
+    value replaces the oldest value of the rolling window in-place, after which the
+    rolling mean and M2 are updated with Welford's online algorithm.
+
+    Parameters
+    ----------
+    window_values : numpy.ndarray
+        The ring buffer (of 32-bit floats) of the values in the current rolling window.
+    window_index : int
+        The position in the ring buffer where the value should be written.
+    window_count : int
+        The number of values in the current rolling window, before adding the value.
+    rolling_mean : float
+        The mean of the current rolling window.
+    rolling_m2 : float
+        The sum of squared differences from the mean of the current rolling window.
+    value : float
+        The value to add to the rolling window.
+    squared_threshold : float
+        The square of the threshold, in standard deviations away from the rolling mean,
+        outside of which the value is an outlier.
+
+    Returns
+    -------
+    tuple
+        A tuple with three elements: the updated rolling mean, the updated M2, and a
+        boolean of whether or not the value is an outlier.
+    """
+    # Replace the oldest value in the rolling window with the new value. The values
+    # are read back from the buffer, so the same (possibly rounded) value is added to
+    # our rolling mean and M2 now, and removed from them later.
+    old_value = np.float64(window_values[window_index])
+    window_values[window_index] = value
+    new_value = np.float64(window_values[window_index])
+
+    # Remove the old value from our rolling mean and M2, once the window is full.
+    if window_count == len(window_values):
+        rolling_mean, rolling_m2 = _remove_from_rolling_window(rolling_mean, rolling_m2, window_count, old_value)
+    else:
+        window_count += 1
+
+    # Add the new value to our rolling mean and M2.
+    rolling_mean, rolling_m2 = _add_to_rolling_window(rolling_mean, rolling_m2, window_count, new_value)
+
+    # The sample variance needs at least two values in the rolling window, so until
+    # then no value is an outlier.
+    if window_count < 2:
+        return rolling_mean, rolling_m2, False
+
+    # Calculate our rolling sample variance, and determine whether our current data
+    # point is an outlier. The (possibly rounded) value from the buffer is used, as
+    # that is the value the rolling mean was calculated from.
+    rolling_variance = rolling_m2 / (window_count - 1)
+    is_outlier = _is_outlier(new_value, rolling_mean, rolling_variance, squared_threshold)
+
+    return rolling_mean, rolling_m2, is_outlier
+
+@numba.njit(cache=True, fastmath=True)
+def _rolling_z_score_batch(window_values, window_index, window_count, rolling_mean, rolling_m2, values, squared_threshold, is_outliers):
+    """Adds a batch of values to the rolling window, and determines which are outliers.
+
+    This function is compiled to native code with Numba, and adds the values of the
+    batch one at a time with `_rolling_z_score_step`, in a single tight loop. This way
+    a whole batch only costs one call from Python.
+
+    Parameters
+    ----------
+    window_values : numpy.ndarray
+        The ring buffer (of 32-bit floats) of the values in the current rolling window.
+    window_index : int
+        The position in the ring buffer where the first value should be written.
+    window_count : int
+        The number of values in the current rolling window, before adding the values.
+    rolling_mean : float
+        The mean of the current rolling window.
+    rolling_m2 : float
+        The sum of squared differences from the mean of the current rolling window.
+    values : numpy.ndarray
+        The values to add to the rolling window.
+    squared_threshold : float
+        The square of the threshold, in standard deviations away from the rolling mean,
+        outside of which values are outliers.
+    is_outliers : numpy.ndarray
+        The boolean array in which to store whether or not each value is an outlier.
+
+    Returns
+    -------
+    tuple
+        A tuple with four elements: the updated ring buffer index, the updated number
+        of values in the rolling window, the updated rolling mean, and the updated M2.
+    """
+    window = len(window_values)
+    for i in range(len(values)):
+        rolling_mean, rolling_m2, is_outlier = _rolling_z_score_step(window_values, window_index, window_count, rolling_mean, rolling_m2, values[i], squared_threshold)
+        is_outliers[i] = is_outlier
+        window_index = (window_index + 1) % window
+        window_count = min(window_count + 1, window)
+
+    return window_index, window_count, rolling_mean, rolling_m2
+
+@numba.guvectorize([(numba.float64[:], numba.int64, numba.float64, numba.float64[:], numba.float64[:], numba.uint8[:])], '(n),(),()->(n),(n),(n)', nopython=True, target='parallel', cache=True)
+def _rolling_z_score(values, window, threshold, rolling_means, rolling_stds, is_outliers):
+    """Runs the rolling window calculations of `rolling_z_score` over a series.
+
+    This is a generalised universal function (gufunc), compiled to native code with
+    Numba, which broadcasts over any leading dimensions of `values`, in parallel. It
+    doesn't validate its arguments, so it should be called via `rolling_z_score`.
+    """
+    squared_threshold = threshold * threshold
+    rolling_mean = 0.0
+    rolling_m2 = 0.0
+    window_count = 0
+
+    for i in range(values.shape[0]):
+        value = values[i]
+
+        # Remove the oldest value from our rolling mean and M2, once the window is full.
+        if window_count == window:
+            rolling_mean, rolling_m2 = _remove_from_rolling_window(rolling_mean, rolling_m2, window_count, values[i - window])
+        else:
+            window_count += 1
+
+        # Add the new value to our rolling mean and M2.
+        rolling_mean, rolling_m2 = _add_to_rolling_window(rolling_mean, rolling_m2, window_count, value)
+
+        rolling_means[i] = rolling_mean
+        if window_count < 2:
+            rolling_stds[i] = np.nan
+            is_outliers[i] = 0
+            continue
+
+        # Calculate our rolling sample standard deviation, and determine whether the
+        # data point is an outlier, with the same test as the streamed data points.
+        rolling_variance = rolling_m2 / (window_count - 1)
+        rolling_stds[i] = np.sqrt(rolling_variance)
+        is_outliers[i] = _is_outlier(value, rolling_mean, rolling_variance, squared_threshold)
+
+def rolling_z_score(values, window, threshold):
+    """Detects outliers of all data points in a series, with rolling window calculations.
+
+    This runs the same rolling window calculations as `process_z_score_outliers` across
+    a whole series at once, rather than on a stream. The calculations are done by a
+    generalised universal function (gufunc), compiled to native code with Numba, which
+    broadcasts over any leading dimensions. So passing a 2D array of shape
+    `(series, time)` detects the outliers of many series (e.g. one per meter) at once,
+    in parallel.
+
+    There is no historical data before the start of a series, so the first `window - 1`
+    data points are calculated over all data points so far (i.e. a smaller window). The
+    very first data point has no standard deviation, and is never an outlier. Neither are
+    data points in a rolling window of equal values.
+
+    Parameters
+    ----------
+    values : array_like
+        The values of the series, along the last dimension.
+    window : int
+        The size of the rolling window in which to perform rolling window calculations.
+    threshold : float
+        The threshold, in standard deviations away from the rolling mean, outside of
+        which data points are outliers.
+
+    Raises
+    ------
+    ValueError
+        If rolling window size is not greater than 1, or values are not at least one
+        dimensional.
+
+    Returns
+    -------
+    tuple
+        A tuple with three arrays, of the same shape as `values`: the rolling means, the
+        rolling sample standard deviations, and whether or not each data point is an
+        outlier (as 0 or 1).
+    """
+    if window <= 1:
+        raise ValueError("Rolling window must be greater than 1.")
+
+    values = np.asarray(values, dtype=np.float64)
+    if values.ndim < 1:
+        raise ValueError("Values must be at least one dimensional.")
+
+    return _rolling_z_score(values, window, threshold)
+
+# Compile the rolling window calculations once at import (or load them from the
+# cache), rather than at the first streamed data point.
+_rolling_z_score_step(np.zeros(2, dtype=np.float32), 1, 1, 0.0, 0.0, 1.0, 1.0)
+_rolling_z_score_batch(np.zeros(2, dtype=np.float32), 1, 1, 0.0, 0.0, np.ones(1), 1.0, np.empty(1, dtype=np.bool_))
+
+async def process_z_score_outliers(get_historical_data, generate_data_stream, window=45, threshold=2.25, timestamp_increment=86_400, stream_delay=1, batch_size=1):
     """Detects outliers of the data points at each point in the stream.
 
     This generator calculates the rolling mean and rolling sample standard deviation
@@ -22,26 +312,38 @@ async def process_z_score_outliers(get_historical_data, generate_data_stream, wi
     Also note: the rolling mean and rolling standard deviation are calculated in
     *constant time* at each data point, instead of iterating through all values in
     the current window. This is achieved by keeping track of the values in the current
-    window with a queue. We can then easily (in constant time) access the first and last
-    values of the queue, which will assist in calculating the rolling mean and sample
-    standard deviation if we move the window one step to the right.
-
-    I.e. assume the rolling window of the queue [4, 3, 5, 9], which has a running total
-    of 21 and a mean of 5.25. If we were to roll this window to the next point, say,
-    [3, 5, 9, 2], instead of iterating through all of these values again to calculate
-    the mean again, we can get the new updated mean by subtracting the last value in our
-    previous window (4) from the running total (21), and add the new value of our current
-    window (2), then divide by the number of elements (4). So, (21-4+2)/4 would be our
-    new mean of 4.75, which we calculated in constant time. This same logic applies to
-    calculating the standard deviation, although the formula is slightly more complex.
+    window with a fixed size ring buffer. We can then easily (in constant time) access
+    the oldest value in the buffer before overwriting it with the newest value, which
+    will assist in calculating the rolling mean and sample standard deviation if we
+    move the window one step to the right.
+
+    I.e. assume the rolling window [4, 3, 5, 9], which has a mean of 5.25.
+    If we were to roll this window to the next point, say, [3, 5, 9, 2], instead of
+    iterating through all of these values again to calculate the mean again, we can
+    get the new updated mean by removing the old value (4) from the mean, and adding
+    the new value (2) to it. So, 5.25 - (4-5.25)/3 = 5.6667 would be the mean of
+    [3, 5, 9], and 5.6667 + (2-5.6667)/4 = 4.75 would be our new mean, which we
+    calculated in constant time.
+
+    The same logic applies to the standard deviation, using Welford's online algorithm.
+    Instead of keeping a running total of the squared values (which loses precision
+    when subtracting nearly equal large numbers, and may even become negative), we keep
+    track of the sum of squared differences from the mean, `M2 = Σ(x - mean)²`, which
+    is updated alongside the mean. The sample variance is then `M2 / (n - 1)`.
 
     Parameters
     ----------
     get_historical_data : function
         The function with which we can retrieve historical data, to aid the rolling window
-        calculations.
+        calculations. It should return either a tuple of two NumPy arrays (the timestamps,
+        and the values of the historical data points), or an iterable of data points as
+        (timestamp, value) tuples. The values are assumed to be valid.
     generate_data_stream : generator
-        The generator which yields our 'live' data stream.
+        The generator which yields our 'live' data stream. It is called with the
+        `timestamp_increment` and `stream_delay` keyword arguments. If `batch_size` is
+        greater than 1, it is also called with the `batch_size` keyword argument, and
+        should yield batches of data points, as tuples of two NumPy arrays: the
+        timestamps, and the values of the data points. Batches may be of any size.
     window : int, optional
         The size of the rolling window in which we'll perform rolling window calculations.
         Defaults to 45 steps.
@@ -53,21 +355,32 @@ async def process_z_score_outliers(get_historical_data, generate_data_stream, wi
         to 86,400 seconds (1 day).
     stream_delay : int, optional
         The delay (in seconds) between each data point streamed. Defaults to 1 second.
+    batch_size : int, optional
+        The number of data points in each batch streamed, whose outliers are detected
+        all at once, with a single call to the compiled rolling window calculations.
+        Defaults to 1 (i.e. data points are streamed, and their outliers detected, one
+        at a time).
 
     Raises
     ------
     ValueError
-        If rolling window size is not greater than 1.
+        If rolling window size is not greater than 1, or batch size is not greater
+        than 0.
 
     Yields
     ------
     tuple
         A data point represented as a tuple with three elements: an X value (timestamp of the
         data recorded), a Y value (energy value in GWh), and a boolean of whether or not this
-        value is an outlier.
+        value is an outlier. Or, if `batch_size` is greater than 1, a batch of data points
+        represented as a tuple with three arrays of X values, Y values, and booleans. To
+        avoid allocating a new array for every batch, the boolean arrays are reused every
+        other batch, so they should be copied if they're needed for longer.
     """
     if window <= 1:
         raise ValueError("Rolling window must be greater than 1.")
+    if batch_size <= 0:
+        raise ValueError("Batch size must be greater than 0.")
 
     # Get historical data `window - 1` steps in the past.
     # This way we can get the moving average at the first data point of the stream.
@@ -75,56 +388,92 @@ async def process_z_score_outliers(get_historical_data, generate_data_stream, wi
     historical_data_start_date = historial_data_end_date - (window - 1) * timestamp_increment
     historical_energy_data = get_historical_data(historical_data_start_date, historial_data_end_date)
 
-    # Keep track of the running total of the values, and running total of the squared
-    # values. This will be used to assist our rolling mean and rolling sample standard
-    # deviation calculations in constant time.
-    rolling_sum = 0
-    rolling_squared_sum = 0
-
-    # Keep track of the values and squared values in our current rolling window, with queues.
-    window_values = deque()
-    window_squared_values = deque()
-
-    # Get our historical data, going back `window - 1` steps in the past.
-    for _, value in historical_energy_data:
-        # Sanity check to make sure we're receiving valid historical data points.
-        if not isinstance(value, (int, float)) or value < 0:
-            print("Invalid value received, discarding...")
-            continue
+    # Historical data is either a tuple of arrays of timestamps and values, or any
+    # iterable of (timestamp, value) data points, whose values we collect into an array.
+    if isinstance(historical_energy_data, tuple) and len(historical_energy_data) == 2 and isinstance(historical_energy_data[1], np.ndarray):
+        historical_values = historical_energy_data[1]
+    else:
+        historical_values = np.fromiter((value for _, value in historical_energy_data), dtype=np.float64)
 
-        rolling_sum += value
-        window_values.append(value)
+    # Only the latest `window - 1` historical values are part of the first rolling window.
+    historical_values = historical_values[-(window - 1):]
 
-        rolling_squared_sum += value ** 2
-        window_squared_values.append(value ** 2)
+    # Keep track of the values in our current rolling window, with a ring buffer. The
+    # index points to the position where the next value will be written, which (once
+    # the buffer is filled) holds the oldest value of the window. The values are stored
+    # as 32-bit floats, which is plenty of precision for energy values, and halves the
+    # size of the buffer.
+    window_values = np.empty(window, dtype=np.float32)
+    window_count = len(historical_values)
+    window_values[:window_count] = historical_values
+    window_index = window_count % window
 
-    # Start streaming our 'live' data.
-    async for timestamp, value in generate_data_stream(timestamp_increment=timestamp_increment, stream_delay=stream_delay):
-        # Sanity check to make sure we're receiving valid data points from the stream.
-        if not isinstance(value, (int, float)) or value < 0:
-            print("Invalid value received, discarding...")
-            continue
+    # Keep track of the rolling mean, and the sum of squared differences from the
+    # rolling mean (M2). These are updated with Welford's online algorithm, to assist
+    # our rolling mean and rolling sample standard deviation calculations in constant
+    # time. Initially, they're calculated (as 64-bit floats) from our historical data,
+    # going back `window - 1` steps in the past, as stored in the ring buffer (which
+    # starts out empty, without any historical data).
+    rolling_mean = 0.0
+    rolling_m2 = 0.0
+    if window_count > 0:
+        initial_values = window_values[:window_count].astype(np.float64)
+        rolling_mean = float(initial_values.mean())
+        deviations = initial_values - rolling_mean
+        rolling_m2 = float((deviations * deviations).sum())
 
-        print(f"Data received from stream • Timestamp: {timestamp} • Value: {value}")
+    # The outlier calculations compare squared distances, so square the threshold once.
+    squared_threshold = threshold * threshold
 
-        # Keep track of our running totals and rolling values.
-        rolling_sum += value
-        window_values.append(value)
+    # Start streaming our 'live' data, either in batches, or one data point at a time.
+    # Streams are only passed `batch_size` when streaming batches, so streams yielding
+    # single data points needn't accept it.
+    if batch_size > 1:
+        # Preallocate two arrays of outlier booleans, and alternate between them for each
+        # batch. This way the consumer can still use the previous batch while the next
+        # one is being processed, without allocating new arrays.
+        outlier_buffers = (np.empty(batch_size, dtype=np.bool_), np.empty(batch_size, dtype=np.bool_))
+        batch_count = 0
 
-        rolling_squared_sum += value ** 2
-        window_squared_values.append(value ** 2)
+        async for timestamps, values in generate_data_stream(timestamp_increment=timestamp_increment, stream_delay=stream_delay, batch_size=batch_size):
+            # Sanity check to make sure we're receiving valid data points from the stream.
+            # This is skipped when running Python with optimisations (`python -O`).
+            if __debug__:
+                valid_values = values >= 0
+                if not valid_values.all():
+                    logger.warning("Invalid values received, discarding...")
+                    timestamps = timestamps[valid_values]
+                    values = values[valid_values]
+                    if len(values) == 0:
+                        continue
 
-        # Calculate our rolling mean and rolling sample standard deviation, and determine
-        # whether our current data point is an outlier.
-        rolling_mean = rolling_sum / window
-        rolling_std = math.sqrt((window * rolling_mean ** 2 - 2 * rolling_mean * rolling_sum + rolling_squared_sum) / (window - 1))
-        is_outlier = abs((value - rolling_mean) / rolling_std) > threshold
+            logger.debug("Data received from stream • Timestamps: %s-%s • Count: %s", timestamps[0], timestamps[-1], len(values))
 
-        yield (timestamp, value, is_outlier)
+            # Streams may yield more data points than `batch_size` in a batch, in which case
+            # grow the outlier buffers, as the compiled calculations don't check bounds.
+            if len(values) > len(outlier_buffers[0]):
+                outlier_buffers = (np.empty(len(values), dtype=np.bool_), np.empty(len(values), dtype=np.bool_))
 
-        # Remove the old values from the rolling window, and update our running totals.
-        old_value = window_values.popleft()
-        rolling_sum -= old_value
+            # Add the batch to the rolling window, and determine which values are outliers.
+            is_outliers = outlier_buffers[batch_count % 2][:len(values)]
+            window_index, window_count, rolling_mean, rolling_m2 = _rolling_z_score_batch(window_values, window_index, window_count, rolling_mean, rolling_m2, values, squared_threshold, is_outliers)
+            batch_count += 1
 
-        old_squared_value = window_squared_values.popleft()
-        rolling_squared_sum -= old_squared_value
+            yield (timestamps, values, is_outliers)
+        return
+
+    async for timestamp, value in generate_data_stream(timestamp_increment=timestamp_increment, stream_delay=stream_delay):
+        # Sanity check to make sure we're receiving valid data points from the stream.
+        # This is skipped when running Python with optimisations (`python -O`).
+        if __debug__ and (not isinstance(value, (int, float)) or value < 0):
+            logger.warning("Invalid value received, discarding...")
+            continue
+
+        logger.debug("Data received from stream • Timestamp: %s • Value: %s", timestamp, value)
+
+        # Add the new value to the rolling window, and determine whether it is an outlier.
+        rolling_mean, rolling_m2, is_outlier = _rolling_z_score_step(window_values, window_index, window_count, rolling_mean, rolling_m2, value, squared_threshold)
+        window_index = (window_index + 1) % window
+        window_count = min(window_count + 1, window)
+
+        yield (timestamp, value, is_outlier)
@@ -1,9 +1,150 @@
 import asyncio
+import functools
 import time
 import math
-import random
 
-def _get_energy_value(timestamp, seasonal_period=365, seasonal_amplitude=500, regular_period=7, regular_amplitude=250, noise=500, y_offset=25_000):
+import numpy as np
+
+# Default periods (in days) of the seasonal and regular cycles, and their angular
+# frequencies (in radians per second), so they don't have to be recalculated for
+# every data point.
+_SECONDS_PER_DAY = 24 * 60 * 60
+_SEASONAL_PERIOD = 365
+_REGULAR_PERIOD = 7
+_SEASONAL_FREQUENCY = 2 * math.pi / (_SEASONAL_PERIOD * _SECONDS_PER_DAY)
+_REGULAR_FREQUENCY = 2 * math.pi / (_REGULAR_PERIOD * _SECONDS_PER_DAY)
+
+# Constants for the SplitMix64 hash function.
+_UINT64_MASK = (1 << 64) - 1
+_GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+_MIX_MULTIPLIER_1 = 0xBF58476D1CE4E5B9
+_MIX_MULTIPLIER_2 = 0x94D049BB133111EB
+
+def _splitmix64(x):
+    """Hashes a 64-bit unsigned integer with the SplitMix64 finalizer.
+
+    Parameters
+    ----------
+    x : int
+        The 64-bit unsigned integer to hash.
+
+    Returns
+    -------
+    int
+        A 64-bit unsigned integer, whose bits are uniformly distributed.
+    """
+    x = ((x ^ (x >> 30)) * _MIX_MULTIPLIER_1) & _UINT64_MASK
+    x = ((x ^ (x >> 27)) * _MIX_MULTIPLIER_2) & _UINT64_MASK
+    return x ^ (x >> 31)
+
+def _get_random_value(timestamp):
+    """Returns a gaussian random value keyed by a timestamp.
+
+    The random value is calculated from a hash of the timestamp, so we will always
+    get the same value for a given timestamp. This allows procedurally getting values
+    at any point in the past, and 'predicting' them at any point in the future.
+
+    The timestamp is hashed with SplitMix64, and that hash is hashed again, to get two
+    uniform random values, which are then transformed into a gaussian random value
+    with the Box-Muller transform. This is much cheaper than reseeding a random number
+    generator on every call. It also keeps no state at all, so unlike seeding the
+    `random` module, it doesn't change the random numbers of any other code, and is
+    safe to call from multiple threads.
+
+    Parameters
+    ----------
+    timestamp : int
+        The timestamp from which to calculate the random value.
+
+    Returns
+    -------
+    float
+        A random value from the standard normal distribution.
+    """
+    x = (timestamp * _GOLDEN_GAMMA) & _UINT64_MASK
+
+    # The second hash is of the first hash, rather than of a nearby input, which would
+    # be the first hash of a neighbouring timestamp.
+    h1 = _splitmix64(x)
+    h2 = _splitmix64(h1)
+
+    # Use the top 53 bits of each hash to get uniform values in the interval (0, 1).
+    u1 = ((h1 >> 11) + 0.5) * 2 ** -53
+    u2 = ((h2 >> 11) + 0.5) * 2 ** -53
+
+    return math.sqrt(-2 * math.log(u1)) * math.cos(2 * math.pi * u2)
+
+def _splitmix64_np(x):
+    """Hashes an array of 64-bit unsigned integers with the SplitMix64 finalizer.
+
+    This is the vectorised equivalent of `_splitmix64`. Overflowing `uint64` array
+    operations wrap around, so no masking is needed.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        The array of 64-bit unsigned integers to hash.
+
+    Returns
+    -------
+    numpy.ndarray
+        An array of 64-bit unsigned integers, whose bits are uniformly distributed.
+    """
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(_MIX_MULTIPLIER_1)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(_MIX_MULTIPLIER_2)
+    return x ^ (x >> np.uint64(31))
+
+def _get_random_values_np(timestamps):
+    """Returns gaussian random values keyed by an array of timestamps.
+
+    This is the vectorised equivalent of `_get_random_value`, and returns the same
+    random values for the same timestamps.
+
+    Parameters
+    ----------
+    timestamps : numpy.ndarray
+        The integer timestamps from which to calculate the random values.
+
+    Returns
+    -------
+    numpy.ndarray
+        An array of random values from the standard normal distribution.
+    """
+    x = timestamps.astype(np.int64).astype(np.uint64) * np.uint64(_GOLDEN_GAMMA)
+
+    # The second hash is of the first hash, matching `_get_random_value`.
+    h1 = _splitmix64_np(x)
+    h2 = _splitmix64_np(h1)
+
+    # Use the top 53 bits of each hash to get uniform values in the interval (0, 1).
+    u1 = ((h1 >> np.uint64(11)) + 0.5) * 2 ** -53
+    u2 = ((h2 >> np.uint64(11)) + 0.5) * 2 ** -53
+
+    return np.sqrt(-2 * np.log(u1)) * np.cos(2 * np.pi * u2)
+
+def _angular_frequency(period):
+    """Returns the angular frequency of a cycle.
+
+    The precalculated angular frequencies are returned for the default periods.
+
+    Parameters
+    ----------
+    period : int
+        The period (in days) for which a cycle lasts.
+
+    Returns
+    -------
+    float
+        The angular frequency (in radians per second) of the cycle.
+    """
+    if period == _SEASONAL_PERIOD:
+        return _SEASONAL_FREQUENCY
+    if period == _REGULAR_PERIOD:
+        return _REGULAR_FREQUENCY
+    return 2 * math.pi / (period * _SECONDS_PER_DAY)
+
+@functools.lru_cache(maxsize=8192)
+def _get_energy_value(timestamp, seasonal_period=_SEASONAL_PERIOD, seasonal_amplitude=500, regular_period=_REGULAR_PERIOD, regular_amplitude=250, noise=500, y_offset=25_000):
     """Calculates the energy value at a timestamp.
 
     This function procedurally generates a data point given a timestamp, for
@@ -12,6 +153,10 @@ def _get_energy_value(timestamp, seasonal_period=365, seasonal_amplitude=500, re
     energy value, going back in time to look at a data point at a timestamp in the
     past, or predicting any data point in the future.
 
+    Since the same arguments always return the same energy value, the most recently
+    calculated energy values are cached, so repeated requests for the same timestamps
+    (e.g. overlapping historical data) aren't recalculated.
+
     This function generates a data point by combining the following 4 functions:
     - A seasonal function: a `sin` function for representing annual cycles, with its
       period being 365 days.
@@ -52,20 +197,57 @@ def _get_energy_value(timestamp, seasonal_period=365, seasonal_amplitude=500, re
     except ValueError:
         raise ValueError("Timestamp is invalid.")
 
+    seasonal_frequency = _angular_frequency(seasonal_period)
+    regular_frequency = _angular_frequency(regular_period)
+
     # Seasonal function
-    seasonal_fn = seasonal_amplitude * math.sin(2 * math.pi * timestamp / (seasonal_period * 24 * 60 * 60))
+    seasonal_fn = seasonal_amplitude * math.sin(seasonal_frequency * timestamp)
 
     # Regular function
-    regular_fn = regular_amplitude * math.sin(2 * math.pi * timestamp / (regular_period * 24 * 60 * 60))
+    regular_fn = regular_amplitude * math.sin(regular_frequency * timestamp)
 
-    # Random function seeded by timestamp, so we will always get the same value for
+    # Random function keyed by timestamp, so we will always get the same value for
     # a given timestamp. This allows procedurally getting timestamps at any point in
     # the past, and 'predicting' them at any point in the future.
-    random.seed(timestamp)
-    random_fn = random.gauss() * noise
+    random_fn = _get_random_value(timestamp) * noise
 
     return seasonal_fn + regular_fn + random_fn + y_offset
 
+def _get_historical_steps(start, end, timestamp_increment):
+    """Calculates the steps of historical data between two timestamps.
+
+    Parameters
+    ----------
+    start : int
+        The timestamp from which to calculate energy values.
+    end : int
+        The timestamp to which to calculate energy values.
+    timestamp_increment : int
+        The value by which the timestamps from `start` should be incremented until
+        `end` is reached.
+
+    Raises
+    ------
+    ValueError
+        If timestamp increment is not greater than 0.
+
+    Returns
+    -------
+    tuple
+        A tuple with two elements: the first timestamp (rounded up to the nearest
+        `timestamp_increment` timestamp), and the number of steps to `end`.
+    """
+    if timestamp_increment <= 0:
+        raise ValueError("Timestamp increment must be greater than 0.")
+
+    # Round up to the nearest `timestamp_increment` timestamp.
+    timestamp = math.ceil(start / timestamp_increment) * timestamp_increment
+
+    # Calculate the number of steps between our starting and ending timestamps.
+    steps = math.floor((end - timestamp) / timestamp_increment) + 1
+
+    return timestamp, steps
+
 def get_historical_energy_data(start, end, timestamp_increment=86_400):
     """Returns historical energy values between two timestamps.
 
@@ -90,24 +272,100 @@ def get_historical_energy_data(start, end, timestamp_increment=86_400):
 
     Returns
     -------
-    list
-        A list of data points between `start` and `end` represented as a list of
+    generator
+        A generator of the data points between `start` and `end` represented as
         tuples, with each tuple having two elements: an X value (timestamp of the
-        data recorded), and a Y value (energy value in GWh).
+        data recorded), and a Y value (energy value in GWh). The data points are
+        calculated lazily, so use `list()` if they are needed all at once.
     """
-    if timestamp_increment <= 0:
-        raise ValueError("Timestamp increment must be greater than 0.")
+    timestamp, steps = _get_historical_steps(start, end, timestamp_increment)
 
-    # Round up to the nearest `timestamp_increment` timestamp.
-    timestamp = math.ceil(start / timestamp_increment) * timestamp_increment
+    # Return a generator of values, rather than building a list of them. Each data
+    # point's timestamp is only calculated once, and reused for its energy value.
+    return (((data_timestamp := timestamp + timestamp_increment * i), _get_energy_value(data_timestamp)) for i in range(steps))
 
-    # Calculate the number of steps between our starting and ending timestamps.
-    steps = math.floor((end - timestamp) / timestamp_increment) + 1
-    
-    # Build and return list of values.
-    return [(timestamp + timestamp_increment * i, _get_energy_value(timestamp + timestamp_increment * i)) for i in range(steps)]
+def _get_energy_values_np(timestamps, seasonal_period=_SEASONAL_PERIOD, seasonal_amplitude=500, regular_period=_REGULAR_PERIOD, regular_amplitude=250, noise=500, y_offset=25_000):
+    """Calculates the energy values at an array of timestamps.
+
+    This is the vectorised equivalent of `_get_energy_value`, calculating the seasonal
+    and regular functions for all timestamps at once, rather than one at a time.
+
+    Parameters
+    ----------
+    timestamps : numpy.ndarray
+        The integer timestamp values for which to calculate the energy values.
+    seasonal_period : int, optional
+        The period (in days) for which a seasonal cycle lasts. Defaults to 365 days.
+    seasonal_amplitude : int, optional
+        The deviation of the highs and lows of the seasonal cycle. Defaults to 500 GWh.
+    regular_period : int, optional
+        The period (in days) for which a regular cycle lasts. Defaults to 7 days.
+    regular_amplitude : int, optional
+        The deviation of the highs and lows of the regular cycle. Defaults to 250 GWh.
+    noise : int, optional
+        Random noise added to the data. Defaults to 500.
+    y_offset : int, optional
+        The Y offset of the data. Defaults to 25,000 GWh.
 
-async def generate_energy_data_stream(timestamp_increment=86_400, stream_delay=1):
+    Returns
+    -------
+    numpy.ndarray
+        An array of floating point numbers representing energy values in GWh.
+    """
+    # Truncate the timestamps to integers once, as `_get_energy_value` does, so the
+    # seasonal, regular and random functions are all calculated at the same timestamps.
+    timestamps = timestamps.astype(np.int64)
+
+    seasonal_frequency = _angular_frequency(seasonal_period)
+    regular_frequency = _angular_frequency(regular_period)
+
+    # Seasonal function
+    seasonal_fn = seasonal_amplitude * np.sin(seasonal_frequency * timestamps)
+
+    # Regular function
+    regular_fn = regular_amplitude * np.sin(regular_frequency * timestamps)
+
+    # Random function keyed by timestamp, matching `_get_energy_value`.
+    random_fn = _get_random_values_np(timestamps) * noise
+
+    return seasonal_fn + regular_fn + random_fn + y_offset
+
+def get_historical_energy_data_np(start, end, timestamp_increment=86_400):
+    """Returns historical energy values between two timestamps, as NumPy arrays.
+
+    This is the vectorised equivalent of `get_historical_energy_data`. Instead of a
+    list of tuples, it returns the timestamps and energy values as two arrays, which
+    can be used directly in vectorised calculations.
+
+    Parameters
+    ----------
+    start : int
+        The timestamp from which to calculate energy values.
+    end : int
+        The timestamp to which to calculate energy values.
+    timestamp_increment : int, optional
+        The value by which the timestamps from `start` should be incremented until
+        `end` is reached. Defaults to 86,400 seconds (1 day).
+
+    Raises
+    ------
+    ValueError
+        If timestamp increment is not greater than 0.
+
+    Returns
+    -------
+    tuple
+        A tuple of two arrays of the data points between `start` and `end`: the X
+        values (timestamps of the data recorded), and the Y values (energy values in
+        GWh).
+    """
+    timestamp, steps = _get_historical_steps(start, end, timestamp_increment)
+
+    # Build and return arrays of timestamps and values.
+    timestamps = timestamp + timestamp_increment * np.arange(steps, dtype=np.int64)
+    return timestamps, _get_energy_values_np(timestamps)
+
+async def generate_energy_data_stream(timestamp_increment=86_400, stream_delay=1, batch_size=1):
     """Simulates an energy data stream.
 
     This generator simulates a continuous real-time data series, yielding data points
@@ -115,6 +373,11 @@ async def generate_energy_data_stream(timestamp_increment=86_400, stream_delay=1
     are represented as a tuple with two elements: an X value (timestamp in seconds),
     and a Y value (energy value in GWh).
 
+    If `batch_size` is greater than 1, the data points are coalesced into batches
+    instead, yielded every `batch_size * stream_delay` seconds. Each batch is
+    represented as a tuple with two NumPy arrays: the X values, and the Y values of
+    its data points. This way the consumer only has to wake up once per batch.
+
     Parameters
     ----------
     timestamp_increment : int, optional
@@ -122,27 +385,42 @@ async def generate_energy_data_stream(timestamp_increment=86_400, stream_delay=1
         Defaults to 86,400 seconds (1 day).
     stream_delay : int, optional
         The delay (in seconds) between each data point streamed. Defaults to 1 second.
+    batch_size : int, optional
+        The number of data points in each yielded batch. Defaults to 1 (i.e. data
+        points are yielded one at a time).
 
     Raises
     ------
     ValueError
-        If timestamp increment, or stream delay is not greater than 0.
+        If timestamp increment, stream delay, or batch size is not greater than 0.
 
     Yields
     ------
     tuple
         A data point represented as a tuple with two elements: an X value (timestamp
-        of the data recorded), and a Y value (energy value in GWh).
+        of the data recorded), and a Y value (energy value in GWh). Or, if `batch_size`
+        is greater than 1, a batch of data points represented as a tuple with two
+        arrays of X values and Y values.
     """
     if timestamp_increment <= 0:
         raise ValueError("Timestamp increment must be greater than 0.")
     if stream_delay <= 0:
         raise ValueError("Stream delay must be greater than 0.")
+    if batch_size <= 0:
+        raise ValueError("Batch size must be greater than 0.")
 
     # Round up to the nearest `timestamp_increment` timestamp.
     timestamp = math.ceil(time.time() / timestamp_increment) * timestamp_increment
     count = 0
     while True:
+        if batch_size > 1:
+            await asyncio.sleep(batch_size * stream_delay) # Simulate delay of the whole batch
+            timestamps = timestamp + timestamp_increment * np.arange(batch_size, dtype=np.int64)
+            yield (timestamps, _get_energy_values_np(timestamps))
+            timestamp += timestamp_increment * batch_size
+            count += batch_size
+            continue
+
         await asyncio.sleep(stream_delay) # Simulate delay
         yield (timestamp, _get_energy_value(timestamp))
         timestamp += timestamp_increment
@@ -1,57 +1,100 @@
 import asyncio
+import logging
 import matplotlib.pyplot as plt
-from collections import deque
+import numpy as np
 
 from anomaly_detection.z_score import process_z_score_outliers
-from energy_data.data import get_historical_energy_data, generate_energy_data_stream
+from energy_data.data import get_historical_energy_data_np, generate_energy_data_stream
+
+logger = logging.getLogger(__name__)
+
+def _write_to_ring_buffer(buffer, position, values):
+    """Copies values into a ring buffer, wrapping around to its start if needed.
+
+    Parameters
+    ----------
+    buffer : numpy.ndarray
+        The ring buffer to copy the values into.
+    position : int
+        The position in the ring buffer at which to copy the first value.
+    values : numpy.ndarray
+        The values to copy. There should be no more values than the size of the buffer.
+    """
+    count = min(len(values), len(buffer) - position)
+    np.copyto(buffer[position:position + count], values[:count])
+    np.copyto(buffer[:len(values) - count], values[count:])
 
 async def main():
     """
     Retrieve the streamed data and whether the values are outliers or not, and
     visualise this data.
 
-    Use queues to keep track of our streamed data points. Appending to queues is
-    constant time. Popping is also constant, which comes in handy when we've seen
-    enough data in the plot, and want to pop old values.
+    Use fixed size ring buffers to keep track of our streamed data points. Writing to
+    a ring buffer is constant time, and once we've seen enough data in the plot, new
+    values simply overwrite the oldest values. The buffers are NumPy arrays, so the
+    plot can use them without converting them first.
+
+    The data points are streamed in batches, which are copied into the ring buffers
+    all at once. Redrawing the plot is much slower than processing a data point, so
+    the plot is only redrawn once per batch.
     """
     # The number of data points to view in the plot.
     view_window = 365
 
-    # Keep track of our streamed data points and outliers.
-    timestamps = deque()
-    values = deque()
-    outliers = deque()
-    
+    # The number of data points in each streamed batch, i.e. between each redraw of
+    # the plot.
+    batch_size = 10
+
+    # Keep track of our streamed data points and outliers, with ring buffers holding
+    # `view_window + 1` data points. Non-outliers are stored as NaN, so they're not
+    # plotted.
+    capacity = view_window + 1
+    timestamps = np.empty(capacity, dtype=np.int64)
+    values = np.empty(capacity, dtype=np.float64)
+    outliers = np.full(capacity, np.nan)
+
     # Initialise plots for our streamed data points and outliers.
-    plt.plot(timestamps, values)
-    plt.plot(timestamps, outliers, 'ro')
+    fig, ax = plt.subplots()
+    values_line, = ax.plot([], [])
+    outliers_line, = ax.plot([], [], 'ro')
+    plt.show(block=False)
 
     steps = 0
-    async for (timestamp, value, is_outlier) in process_z_score_outliers(get_historical_energy_data, generate_energy_data_stream, stream_delay=0.05):
-        print(f"Plotting data • Timestamp: {timestamp} • Value: {value} • Outlier?: {is_outlier}")
+    async for (batch_timestamps, batch_values, batch_outliers) in process_z_score_outliers(get_historical_energy_data_np, generate_energy_data_stream, stream_delay=0.05, batch_size=batch_size):
+        # Only count the outliers when debug messages are logged.
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Plotting data • Timestamps: %s-%s • Outliers: %s", batch_timestamps[0], batch_timestamps[-1], np.count_nonzero(batch_outliers))
 
-        # Append (in constant time) to our values.
-        timestamps.append(timestamp)
-        values.append(value)
-        outliers.append(value if is_outlier else None)
+        # Overwrite (in constant time per value) the oldest values, once the buffers
+        # are full.
+        position = steps % capacity
+        _write_to_ring_buffer(timestamps, position, batch_timestamps)
+        _write_to_ring_buffer(values, position, batch_values)
+        _write_to_ring_buffer(outliers, position, np.where(batch_outliers, batch_values, np.nan))
 
-        # Pop old values once we've reached our desired number of data points.
-        if steps > view_window:
-            timestamps.popleft()
-            values.popleft()
-            outliers.popleft()
+        steps += len(batch_values)
+
+        # Get the buffered values in chronological order, starting from the oldest value.
+        start = steps % capacity if steps > capacity else 0
+        count = min(steps, capacity)
+        ordered_timestamps = np.concatenate((timestamps[start:count], timestamps[:start]))
+        ordered_values = np.concatenate((values[start:count], values[:start]))
+        ordered_outliers = np.concatenate((outliers[start:count], outliers[:start]))
 
         # Update the chart data with our latest values.
-        plt.gca().lines[0].set_data(timestamps, values)
-        plt.gca().lines[1].set_data(timestamps, outliers)
+        values_line.set_data(ordered_timestamps, ordered_values)
+        outliers_line.set_data(ordered_timestamps, ordered_outliers)
 
         # Keep the data in view.
-        plt.gca().relim()
-        plt.gca().autoscale_view()
-
-        plt.pause(0.01) # A slight pause to allow the plots to render.
+        ax.relim()
+        ax.autoscale_view()
 
-        steps += 1
+        # Render the plots, without blocking the stream.
+        fig.canvas.draw_idle()
+        fig.canvas.flush_events()
 
 if __name__ == "__main__":
+    # Per data point messages are logged at the DEBUG level, and are hidden by default,
+    # since writing them would slow the stream down.
+    logging.basicConfig(level=logging.INFO)
     asyncio.run(main())
@@ -0,0 +1,61 @@
+import asyncio
+import unittest
+
+import numpy as np
+
+from anomaly_detection.z_score import process_z_score_outliers, rolling_z_score
+
+def _get_no_historical_data(start, end):
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+def _noisy_then_constant_values(noisy_count=200, constant_count=200):
+    rng = np.random.default_rng(0)
+    return np.concatenate((rng.normal(25_000, 500, noisy_count), np.full(constant_count, 25_000.0)))
+
+def _collect_outliers(values, **kwargs):
+    """Runs `process_z_score_outliers` over the values, and returns the outlier flags."""
+    batch_size = kwargs.get('batch_size', 1)
+
+    async def generate_data_stream(timestamp_increment, stream_delay, batch_size=1):
+        timestamps = np.arange(len(values), dtype=np.int64) * timestamp_increment
+        if batch_size > 1:
+            for i in range(0, len(values), batch_size):
+                yield timestamps[i:i + batch_size], values[i:i + batch_size]
+        else:
+            for timestamp, value in zip(timestamps, values):
+                yield int(timestamp), float(value)
+
+    async def collect():
+        is_outliers = []
+        async for data in process_z_score_outliers(_get_no_historical_data, generate_data_stream, **kwargs):
+            if batch_size > 1:
+                is_outliers.extend(data[2])
+            else:
+                is_outliers.append(data[2])
+        return np.array(is_outliers, dtype=np.bool_)
+
+    return asyncio.run(collect())
+
+class ConstantTailTest(unittest.TestCase):
+    """A constant tail after noisy values has no outliers, however M2 is rounded."""
+
+    def test_stream(self):
+        values = _noisy_then_constant_values()
+        is_outliers = _collect_outliers(values)
+        self.assertEqual(len(is_outliers), len(values))
+        self.assertFalse(is_outliers[200:].any())
+
+    def test_stream_batches(self):
+        values = _noisy_then_constant_values()
+        is_outliers = _collect_outliers(values, batch_size=10)
+        self.assertEqual(len(is_outliers), len(values))
+        self.assertFalse(is_outliers[200:].any())
+
+    def test_rolling_z_score(self):
+        values = _noisy_then_constant_values()
+        _, rolling_stds, is_outliers = rolling_z_score(values, 45, 2.25)
+        self.assertFalse(is_outliers[200:].any())
+        self.assertFalse(np.isnan(rolling_stds[1:]).any())
+
+if __name__ == '__main__':
+    unittest.main()